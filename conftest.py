@@ -1,4 +1,6 @@
-from contextlib import contextmanager, ExitStack, wraps
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, ExitStack
+from functools import lru_cache
 from itertools import chain
 import json
 import logging
@@ -6,12 +8,24 @@ import os
 from uuid import uuid4
 
 import boto3
+from botocore.config import Config
 import pytest
 
 from common import log_call
 
 LOGGER = logging.getLogger(__file__)
 LOGGER.setLevel(os.getenv('LOGGING_LEVEL') or logging.INFO)
+IAM_ENDPOINT_URL = os.getenv('IAM_URL', '') or None
+S3_ENDPOINT_URL = os.getenv('S3_URL', '') or None
+REGION = os.getenv('AWS_DEFAULT_REGION', '') or None
+BOTO_CONFIG = Config(
+    max_pool_connections=32,
+    tcp_keepalive=True,
+    retries={
+        'max_attempts': 10,
+        'mode': 'adaptive',
+    },
+)
 
 
 @pytest.fixture(scope='function')
@@ -19,6 +33,28 @@ def iam_role():
     return temp_iam_role_context
 
 
+@lru_cache(maxsize=None)
+def get_assume_role_policy(service):
+    """
+    Returns the serialized policy allowing the service to assume a role
+    """
+    return json.dumps(
+        {
+            "Version": "2012-10-17",
+            "Statement": [
+                {
+                    "Action": "sts:AssumeRole",
+                    "Principal": {
+                        "Service": service,
+                    },
+                    "Effect": "Allow",
+                    "Sid": "",
+                },
+            ],
+        },
+    )
+
+
 @contextmanager
 def temp_iam_role_context(
         policy_arn='arn:aws:iam::aws:policy/service-role/AWSLambdaRole',
@@ -29,31 +65,17 @@ def temp_iam_role_context(
     """
     version = str(uuid4()).replace('-', '')[:10].upper()
     role_name = prefix + version
-    connection_args = {}
-    if os.getenv('IAM_URL', None):
-        connection_args['endpoint_url'] = os.environ['IAM_URL']
-    if os.getenv('AWS_DEFAULT_REGION', None):
-        connection_args['region_name'] = os.environ['AWS_DEFAULT_REGION']
-    iam_client = boto3.client('iam', **connection_args)
+    iam_client = boto3.client(
+        'iam',
+        endpoint_url=IAM_ENDPOINT_URL,
+        region_name=REGION,
+        config=BOTO_CONFIG,
+    )
 
     with ExitStack() as stack:
         role_cmd = iam_client.create_role(
             RoleName=role_name,
-            AssumeRolePolicyDocument=json.dumps(
-                {
-                    "Version": "2012-10-17",
-                    "Statement": [
-                        {
-                            "Action": "sts:AssumeRole",
-                            "Principal": {
-                                "Service": service,
-                            },
-                            "Effect": "Allow",
-                            "Sid": "",
-                        },
-                    ],
-                },
-            ),
+            AssumeRolePolicyDocument=get_assume_role_policy(service),
         )
         LOGGER.info('Created role = %s', role_name)
         stack.callback(
@@ -83,15 +105,14 @@ def temp_bucket_context(prefix='temp-bucket-'):
     """
     Creates a temporary bucket
     """
-    connection_args = {}
-    if os.getenv('S3_URL', None):
-        connection_args['endpoint_url'] = os.environ['S3_URL']
-    if os.getenv('AWS_DEFAULT_REGION', None):
-        connection_args['region_name'] = os.environ['AWS_DEFAULT_REGION']
-
     version = str(uuid4()).replace('-', '')[:10].lower()
     bucket_name = prefix + version
-    s3_client = boto3.client('s3', **connection_args)
+    s3_client = boto3.client(
+        's3',
+        endpoint_url=S3_ENDPOINT_URL,
+        region_name=REGION,
+        config=BOTO_CONFIG,
+    )
 
     s3_client.create_bucket(
         Bucket=bucket_name,
@@ -105,26 +126,35 @@ def temp_bucket_context(prefix='temp-bucket-'):
         yield bucket_name
     finally:
         LOGGER.info('Deleted bucket %s', bucket_name)
-        versions = s3_client.list_object_versions(
-            Bucket=bucket_name, MaxKeys=100)
-
-        objects = []
-        all_versions = chain(
-            versions.get('Versions', None) or [],
-            versions.get('DeleteMarkers', None) or [],
+        pages = s3_client.get_paginator('list_object_versions').paginate(
+            Bucket=bucket_name,
         )
 
-        for version in all_versions:
-            objects.append({
-                'Key': version['Key'],
-                'VersionId': version['VersionId'],
-            })
-
-        if objects:
-            s3_client.delete_objects(
-                Bucket=bucket_name,
-                Delete={
-                    'Objects': objects,
-                },
+        # delete_objects accepts at most 1000 keys per request
+        batches = [[]]
+        for page in pages:
+            all_versions = chain(
+                page.get('Versions', None) or [],
+                page.get('DeleteMarkers', None) or [],
             )
+
+            for version in all_versions:
+                if len(batches[-1]) == 1000:
+                    batches.append([])
+                batches[-1].append({
+                    'Key': version['Key'],
+                    'VersionId': version['VersionId'],
+                })
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            list(executor.map(
+                lambda objects: s3_client.delete_objects(
+                    Bucket=bucket_name,
+                    Delete={
+                        'Objects': objects,
+                        'Quiet': True,
+                    },
+                ),
+                [objects for objects in batches if objects],
+            ))
         s3_client.delete_bucket(Bucket=bucket_name)
@@ -7,20 +7,42 @@
 from __future__ import print_function
 
 from base64 import b64encode
+from concurrent.futures import ThreadPoolExecutor
+import functools
 import hashlib
 import logging
 import json
+import mmap
 import os
-from shutil import rmtree
-from tempfile import mkdtemp
 import traceback
-from zipfile import ZipFile
 
 from ansible.module_utils.basic import AnsibleModule
 import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
 
 LOGGER = logging.getLogger(__name__)
 LOGGER.setLevel(os.getenv('LOGGING_LEVEL') or logging.INFO)
+LAMBDA_ENDPOINT_URL = os.getenv('LAMBDA_URL', '') or None
+S3_ENDPOINT_URL = os.getenv('S3_URL', '') or None
+REGION = os.getenv('AWS_DEFAULT_REGION', '') or None
+BOTO_CONFIG = Config(
+    max_pool_connections=32,
+    tcp_keepalive=True,
+    retries={
+        'max_attempts': 10,
+        'mode': 'adaptive',
+    },
+)
+SESSION = boto3.session.Session()
+# files below this size are read into memory in one go to be hashed
+SMALL_FILE_SIZE = 64 * 1024 * 1024
+TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=8 * 1024 * 1024,
+    multipart_chunksize=8 * 1024 * 1024,
+    max_concurrency=8,
+    use_threads=True,
+)
 
 
 ANSIBLE_METADATA = {
@@ -122,47 +144,75 @@ stderr:
 '''
 
 
+@functools.lru_cache(maxsize=None)
+def _get_client(service, endpoint_url=None, region_name=None):
+    """
+    Returns a boto3 client for the service from the module-wide session,
+    reusing it across calls.
+    """
+    return SESSION.client(
+        service,
+        endpoint_url=endpoint_url,
+        region_name=region_name,
+        config=BOTO_CONFIG,
+    )
+
+
 def get_file_checksum(path):
     """
     Calculates the checksum of the local file.
     """
     with open(path, 'rb') as fp:
-        hasher = hashlib.sha256()
-        chunk = fp.read(1_000_000)
-        while chunk:
-            hasher.update(chunk)
-            chunk = fp.read(1_000_000)
+        if os.fstat(fp.fileno()).st_size < SMALL_FILE_SIZE:
+            hasher = hashlib.sha256(fp.read())
+        elif hasattr(hashlib, 'file_digest'):
+            hasher = hashlib.file_digest(fp, 'sha256')
+        else:
+            # Python < 3.11: hand the whole mapped file to hashlib at once
+            hasher = hashlib.sha256()
+            with mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                hasher.update(mapped)
         return b64encode(hasher.digest()).decode('ascii')
 
 
 def fetch_s3_checksum(bucket, object_key, object_version=None, metadata='sha256'):
     """
-    Gets the SHA-256 checksum of the object via the metadata
-    'sha256' or downloading and calculating locally if that is not available.
+    Gets the SHA-256 checksum of the object via the metadata 'sha256', the
+    S3 additional checksum or downloading and calculating locally if neither
+    is available.
 
     Returns a tuple (checksum, downloaded).
     """
-    s3_client = boto3.client('s3')
+    s3_client = _get_client('s3', S3_ENDPOINT_URL, REGION)
+
+    options = dict(
+        Bucket=bucket,
+        Key=object_key,
+    )
+    if object_version:
+        options['VersionId'] = object_version
 
     try:
-        options = dict(
-            Bucket=bucket,
-            Key=object_key,
-        )
-        if object_version:
-            options['VersionId'] = object_version
-        obj = s3_client.get_object(**options)
-        if not obj['Metadata'].get(metadata, None):
-            LOGGER.info(
-                'No metadata %r, downloading to calculate the checksum', metadata)
-            hasher = hashlib.sha256()
-            hasher.update(obj['Body'].read())
-            return b64encode(hasher.digest()).decode('ascii'), True
-        else:
-            return obj['Metadata'][metadata], False
+        head = s3_client.head_object(ChecksumMode='ENABLED', **options)
+    except s3_client.exceptions.ClientError as e:
+        if e.response['Error']['Code'] in ('404', 'NoSuchKey'):
+            return None, None
+        raise
+
+    if head['Metadata'].get(metadata, None):
+        return head['Metadata'][metadata], False
 
-    except s3_client.exceptions.NoSuchKey:
-        return None, None
+    # multipart uploads get a composite '<checksum>-<parts>' instead
+    s3_checksum = head.get('ChecksumSHA256', None)
+    if s3_checksum and '-' not in s3_checksum:
+        return s3_checksum, False
+
+    LOGGER.info(
+        'No metadata %r, downloading to calculate the checksum', metadata)
+    obj = s3_client.get_object(**options)
+    hasher = hashlib.sha256()
+    hasher.update(obj['Body'].read())
+    return b64encode(hasher.digest()).decode('ascii'), True
 
 
 def upload_file(path, bucket, object_key, checksum=None, metadata='sha256'):
@@ -171,19 +221,25 @@ def upload_file(path, bucket, object_key, checksum=None, metadata='sha256'):
 
     Returns the version ID or None
     """
-    s3_client = boto3.client('s3')
+    s3_client = _get_client('s3', S3_ENDPOINT_URL, REGION)
 
     checksum = checksum or get_file_checksum(path)
     with open(path, 'rb') as fp:
-        obj = s3_client.put_object(
-            Body=fp,
-            Bucket=bucket,
-            Key=object_key,
-            Metadata={
-                metadata: checksum,
+        s3_client.upload_fileobj(
+            fp,
+            bucket,
+            object_key,
+            ExtraArgs={
+                'ChecksumAlgorithm': 'SHA256',
+                'Metadata': {
+                    metadata: checksum,
+                },
             },
+            Config=TRANSFER_CONFIG,
         )
-        return obj.get('VersionId', '') or None
+
+    obj = s3_client.head_object(Bucket=bucket, Key=object_key)
+    return obj.get('VersionId', '') or None
 
 
 def get_layer_version_info(name, local_checksum=None, lambda_client=None):
@@ -192,72 +248,49 @@ def get_layer_version_info(name, local_checksum=None, lambda_client=None):
     with the given name.
     """
 
-    connection_args = {}
-    if os.getenv('LAMBDA_URL', None):
-        connection_args['endpoint_url'] = os.environ['LAMBDA_URL']
-    if os.getenv('AWS_DEFAULT_REGION', None):
-        connection_args['region_name'] = os.environ['AWS_DEFAULT_REGION']
-
-    lambda_client = lambda_client or boto3.client('lambda', **connection_args)
-    all_versions = set()
-
-    response = lambda_client.list_layer_versions(LayerName=name)
-    all_versions |= {v['Version'] for v in response['LayerVersions']}
-    marker = response.get('NextMarker', None)
+    lambda_client = lambda_client or _get_client('lambda', LAMBDA_ENDPOINT_URL, REGION)
+    pages = lambda_client.get_paginator('list_layer_versions').paginate(
+        LayerName=name,
+    )
+    all_versions = (v['Version'] for page in pages for v in page['LayerVersions'])
 
-    while marker:
-        response = lambda_client.list_layer_versions(
-            LayerName=name, NextMarker=marker)
-        all_versions |= {v['Version'] for v in response['LayerVersions']}
-        marker = response.get('NextMarker', None)
+    if not local_checksum:
+        last_version = max(all_versions, default=None)
+        if last_version is None:
+            return None
+        return lambda_client.get_layer_version(
+            LayerName=name,
+            VersionNumber=last_version,
+        )
 
-    versions = []
-    for version_number in all_versions:
+    # newest first, so only the versions up to the match are fetched
+    for version_number in sorted(all_versions, reverse=True):
         version = lambda_client.get_layer_version(
             LayerName=name,
             VersionNumber=version_number,
         )
-        if not local_checksum or local_checksum == version['Content']['CodeSha256']:
-            versions.append(version_number)
+        if local_checksum == version['Content']['CodeSha256']:
+            return version
 
-    try:
-        last_version = max(versions)
-    except ValueError:
-        return None
-    else:
-        return lambda_client.get_layer_version(
-            LayerName=name,
-            VersionNumber=last_version,
-        )
+    return None
 
 
 def destroy_layer(name, lambda_client=None):
-    connection_args = {}
-    if os.getenv('LAMBDA_URL', None):
-        connection_args['endpoint_url'] = os.environ['LAMBDA_URL']
-    if os.getenv('AWS_DEFAULT_REGION', None):
-        connection_args['region_name'] = os.environ['AWS_DEFAULT_REGION']
-
-    lambda_client = lambda_client or boto3.client('lambda', **connection_args)
-    versions = set()
-
-    response = lambda_client.list_layer_versions(LayerName=name)
-
-    versions |= {v['Version'] for v in response['LayerVersions']}
-    marker = response.get('NextMarker', None)
-
-    while marker:
-        response = lambda_client.list_layer_versions(
-            LayerName=name, NextMarker=marker)
-        versions |= {v['Version'] for v in response['LayerVersions']}
-        marker = response.get('NextMarker', None)
+    lambda_client = lambda_client or _get_client('lambda', LAMBDA_ENDPOINT_URL, REGION)
+    pages = lambda_client.get_paginator('list_layer_versions').paginate(
+        LayerName=name,
+    )
+    versions = [v['Version'] for page in pages for v in page['LayerVersions']]
 
     LOGGER.info('Destroying versions %s of layer %s', sorted(versions), name)
-    for version in versions:
-        lambda_client.delete_layer_version(
-            LayerName=name,
-            VersionNumber=version,
-        )
+    with ThreadPoolExecutor(max_workers=16) as executor:
+        list(executor.map(
+            lambda version: lambda_client.delete_layer_version(
+                LayerName=name,
+                VersionNumber=version,
+            ),
+            versions,
+        ))
 
     return bool(versions)
 
@@ -266,16 +299,14 @@ def manage_lambda_layer(name, bucket, object_key, object_version, path, state, r
     result = dict(
         changed=False,
     )
-    connection_args = {}
     runtimes = runtimes or []
+    lambda_client = _get_client('lambda', LAMBDA_ENDPOINT_URL, REGION)
 
-    if os.getenv('LAMBDA_URL', None):
-        connection_args['endpoint_url'] = os.environ['LAMBDA_URL']
-    if os.getenv('AWS_DEFAULT_REGION', None):
-        connection_args['region_name'] = os.environ['AWS_DEFAULT_REGION']
+    if state == 'absent':
+        result['changed'] = destroy_layer(name, lambda_client)
+        return result
 
-    lambda_client = boto3.client('lambda', **connection_args)
-    local_checksum = state == 'absent' or get_file_checksum(path)
+    local_checksum = get_file_checksum(path)
     layer = get_layer_version_info(name, local_checksum, lambda_client)
 
     LOGGER.info('bool(get_layer_version_info): %s', bool(layer))
@@ -285,18 +316,9 @@ def manage_lambda_layer(name, bucket, object_key, object_version, path, state, r
         result['version_arn'] = layer['LayerVersionArn']
         result['version_checksum'] = layer['Content']['CodeSha256']
         result['runtimes'] = layer.get('CompatibleRuntimes', []) or []
-        if state == 'absent':
-            result['changed'] = True
-            destroy_layer(name, lambda_client)
-            return result
-    elif state == 'absent':
-        result['changed'] = destroy_layer(name, lambda_client)
-        return result
 
     s3_checksum, downloaded = fetch_s3_checksum(
         bucket, object_key, object_version, metadata=metadata)
-    local_checksum = get_file_checksum(path)
-    assert local_checksum
 
     result['bucket'] = bucket
     result['object_version'] = object_version
@@ -338,16 +360,10 @@ def run_module():
         object_key=dict(type='str', default=None),
         object_version=dict(type='str', default=None),
         path=dict(type='str', default=None),
-        region=dict(type='str', default=(
-            os.getenv('AWS_DEFAULT_REGION', '') or None
-        ), aliases=['aws_region']),
+        region=dict(type='str', default=REGION, aliases=['aws_region']),
         runtimes=dict(type='list', default=None),
-        s3_endpoint_url=dict(type='str', default=(
-            os.getenv('S3_URL', '') or None
-        )),
-        lambda_endpoint_url=dict(type='str', default=(
-            os.getenv('LAMBDA_URL', '') or None
-        )),
+        s3_endpoint_url=dict(type='str', default=S3_ENDPOINT_URL),
+        lambda_endpoint_url=dict(type='str', default=LAMBDA_ENDPOINT_URL),
         state=dict(type='str', default='present',
                    choices=['present', 'absent']),
     )
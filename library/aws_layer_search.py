@@ -6,12 +6,7 @@
 
 from __future__ import print_function
 
-from base64 import b64encode
-import hashlib
 import os
-from shutil import rmtree
-from tempfile import mkdtemp
-from zipfile import ZipFile
 
 import boto3
 
@@ -1,14 +1,29 @@
-from contextlib import wraps
+from functools import wraps
+from itertools import chain
+
+
+class _CallArguments:
+    """
+    Renders the arguments of a call only when the log record is formatted.
+    """
+
+    def __init__(self, args, kwargs):
+        self.args = args
+        self.kwargs = kwargs
+
+    def __str__(self):
+        return ', '.join(chain(
+            (repr(a) for a in self.args),
+            (f'{k}={repr(v)}' for k, v in self.kwargs.items()),
+        ))
 
 
 def log_call(logger, f):
+    owner = getattr(f, '__self__', None)
+    name = f'{owner.__class__.__name__}.{f.__name__}' if owner is not None else f.__qualname__
+
     @wraps(f)
     def inner(*args, **kwargs):
-        args_str = ''
-        if args:
-            args_str += ', '.join(repr(a) for a in args)
-        if kwargs:
-            args_str += (', ' if args else '') + ', '.join(f'{k}={repr(v)}' for k, v in kwargs.items())
-        logger.info(f'Called {f.__class__.__name__}.{f.__name__}({args_str})')
-        f(*args, **kwargs)
+        logger.info('Called %s(%s)', name, _CallArguments(args, kwargs))
+        return f(*args, **kwargs)
     return inner
@@ -2,7 +2,7 @@ from contextlib import ExitStack
 import logging
 import os
 from uuid import uuid4
-from zipfile import ZipFile
+from zipfile import ZIP_STORED, ZipFile, ZipInfo
 
 from aws_lambda_layer import (
     destroy_layer, get_layer_version_info, manage_lambda_layer
@@ -13,9 +13,18 @@ LOGGER.setLevel(os.getenv('LOGGING_LEVEL') or logging.INFO)
 
 
 def create_zip(path, suffix):
-    with ZipFile(path, 'w') as zip_fp:
-        with zip_fp.open('bin/layer.sh', 'w') as fp:
-            fp.write(f'echo "{suffix}"'.encode('ascii'))
+    # fixed timestamp, so the same suffix always yields the same checksum
+    with ZipFile(path, 'w', ZIP_STORED) as zip_fp:
+        zip_fp.writestr(
+            ZipInfo('bin/layer.sh'),
+            f'echo "{suffix}"'.encode('ascii'),
+        )
+
+
+def create_large_zip(path, size=9 * 1024 * 1024):
+    # random data doesn't shrink, so the bundle stays above the multipart threshold
+    with ZipFile(path, 'w', ZIP_STORED) as zip_fp:
+        zip_fp.writestr(ZipInfo('bin/blob'), os.urandom(size))
 
 
 def test_layer_creation(temp_bucket, tmp_path):
@@ -49,7 +58,7 @@ def test_layer_creation(temp_bucket, tmp_path):
             name, bucket, object_key, None, path, 'present', metadata='unique')
         assert result3['version_arn'] == result2['version_arn']
         assert not result3['changed']
-        assert result3['downloaded']
+        assert not result3['downloaded']
 
         # Deploying a different bundle
         create_zip(path, suffix + 'other-suffix')
@@ -69,6 +78,21 @@ def test_layer_creation(temp_bucket, tmp_path):
         assert result5['changed']
         assert not result5['downloaded']
 
+        # Deploying a bundle big enough for a multipart upload
+        create_large_zip(path)
+        result6 = manage_lambda_layer(
+            name, bucket, object_key, None, path, 'present')
+        assert result6['version_arn'] != result5['version_arn']
+        assert result6['changed']
+        assert not result6['downloaded']
+
+        # The composite S3 checksum of a multipart upload can't be used
+        result7 = manage_lambda_layer(
+            name, bucket, object_key, None, path, 'present', metadata='unique')
+        assert result7['version_arn'] == result6['version_arn']
+        assert not result7['changed']
+        assert result7['downloaded']
+
         assert get_layer_version_info(name)
         manage_lambda_layer(name, None, None, None, None, 'absent')
         assert not get_layer_version_info(name)
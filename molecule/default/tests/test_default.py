@@ -1,23 +1,53 @@
 from base64 import b64encode, b64decode
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import ExitStack
+from functools import lru_cache
 from io import BytesIO
 import logging
 import json
 import os
-from tempfile import TemporaryDirectory
+from pathlib import Path
+import random
 import time
-from zipfile import ZipFile
+from zipfile import ZIP_STORED, ZipFile, ZipInfo
 
 import boto3
-
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
 
 from common import log_call
 
 LOGGER = logging.getLogger(__file__)
 LOGGER.setLevel(os.getenv('LOGGING_LEVEL') or logging.INFO)
 MY_PATH = os.path.dirname(os.path.abspath(__file__))
+LAMBDA_ENDPOINT_URL = os.getenv('LAMBDA_URL', '') or None
+REGION = os.getenv('AWS_DEFAULT_REGION', '') or None
+SAMPLE_RB = Path(MY_PATH, 'sample-data/ruby2.5/sample.rb').read_bytes()
+BOTO_CONFIG = Config(
+    retries={
+        'max_attempts': 8,
+        'mode': 'adaptive',
+    },
+)
+TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=8 * 1024 * 1024,
+    multipart_chunksize=8 * 1024 * 1024,
+    max_concurrency=10,
+    use_threads=True,
+)
+
+
+@lru_cache(maxsize=None)
+def _get_client(service, endpoint_url=None, region_name=None):
+    return boto3.client(
+        service,
+        endpoint_url=endpoint_url,
+        region_name=region_name,
+        config=BOTO_CONFIG,
+    )
 
 
+@lru_cache(maxsize=1)
 def get_temp_path():
     return os.getenv(
         'MOLECULE_EPHEMERAL_DIRECTORY',
@@ -25,28 +55,53 @@ def get_temp_path():
     )
 
 
+@lru_cache(maxsize=1)
 def get_temp_suffix():
     with open(os.path.join(get_temp_path(), 'temp-suffix.txt')) as fp:
         return fp.read().strip()
 
 
-def upload_sample_bundle(bucket):
-    s3_client = boto3.client('s3')
-    object_key = 'lambda-bundle.zip'
-    sample_path = os.path.join(MY_PATH, 'sample-data/ruby2.5/sample.rb')
+def load_json(path):
+    with open(path) as fp:
+        return json.load(fp)
+
+
+@lru_cache(maxsize=8)
+def get_structure(content):
+    """
+    Returns the directories inside the base64-encoded ZIP
+    """
+    fp = BytesIO(b64decode(content))
+    with ZipFile(fp) as bundle:
+        return frozenset(
+            item.filename for item in bundle.infolist() if item.is_dir()
+        )
+
 
-    with TemporaryDirectory() as tempdir:
-        zip_path = os.path.join(tempdir, 'lambda-bundle.zip')
+def get_sample_bundle():
+    """
+    Returns the bytes of the ZIP bundle with the sample function
+    """
+    # Lambda runs as another user, so the handler must be world-readable
+    info = ZipInfo('sample.rb')
+    info.external_attr = 0o644 << 16
 
-        with ZipFile(zip_path, 'w') as zip_fp:
-            zip_fp.write(sample_path, arcname='sample.rb')
+    fp = BytesIO()
+    with ZipFile(fp, 'w', ZIP_STORED) as zip_fp:
+        zip_fp.writestr(info, SAMPLE_RB)
+    return fp.getvalue()
 
-        with open(zip_path, 'rb') as fp:
-            s3_client.put_object(
-                Body=fp,
-                Bucket=bucket,
-                Key=object_key,
-            )
+
+def upload_sample_bundle(bucket):
+    s3_client = _get_client('s3')
+    object_key = 'lambda-bundle.zip'
+
+    s3_client.upload_fileobj(
+        BytesIO(get_sample_bundle()),
+        bucket,
+        object_key,
+        Config=TRANSFER_CONFIG,
+    )
     return object_key
 
 
@@ -57,18 +112,12 @@ def test_layer_deployment(iam_role):
     bucket_name = 'temp-bucket-' + suffix
     object_key = upload_sample_bundle(bucket_name)
 
-    connection_args = {}
-    if os.getenv('LAMBDA_URL', None):
-        connection_args['endpoint_url'] = os.environ['LAMBDA_URL']
-    if os.getenv('AWS_DEFAULT_REGION', None):
-        connection_args['region_name'] = os.environ['AWS_DEFAULT_REGION']
-    lambda_client = boto3.client('lambda', **connection_args)
+    lambda_client = _get_client('lambda', LAMBDA_ENDPOINT_URL, REGION)
 
     versions = lambda_client.list_layer_versions(
         LayerName=layer_name)['LayerVersions']
     LOGGER.info('versions of layer %s = %s', layer_name, versions)
-    last_version = sorted(versions, reverse=True,
-                          key=lambda v: v['Version'])[0]
+    last_version = max(versions, key=lambda v: int(v['Version']))
     layer_version_arn = last_version['LayerVersionArn']
 
     layer_info = lambda_client.get_layer_version(
@@ -76,8 +125,8 @@ def test_layer_deployment(iam_role):
         VersionNumber=last_version['Version'],
     )
 
-    with open(os.path.join(get_temp_path(), 'role-variables-main.json')) as fp:
-        main_vars = json.load(fp)
+    main_vars = load_json(
+        os.path.join(get_temp_path(), 'role-variables-main.json'))
 
     assert main_vars['aws_lambda_dependency_layer_state'] == 'present'
     assert main_vars['aws_lambda_dependency_layer_name'] == layer_name
@@ -89,7 +138,8 @@ def test_layer_deployment(iam_role):
     with ExitStack() as stack:
         role_arn = stack.enter_context(iam_role())
 
-        for i in range(6):
+        attempts = 6
+        for i in range(attempts):
             try:
                 lambda_client.create_function(
                     FunctionName=function_name,
@@ -113,7 +163,8 @@ def test_layer_deployment(iam_role):
                 )
             except lambda_client.exceptions.ClientError as e:
                 LOGGER.error('Lambda error: %s', str(e))
-                time.sleep(3)
+                if i < attempts - 1:
+                    time.sleep(min(30, 2 ** i) + random.random())
             else:
                 LOGGER.info('Function %s created', function_name)
                 break
@@ -124,6 +175,9 @@ def test_layer_deployment(iam_role):
             log_call(LOGGER, lambda_client.delete_function),
             FunctionName=function_name,
         )
+        lambda_client.get_waiter('function_active_v2').wait(
+            FunctionName=function_name,
+        )
         invocation = lambda_client.invoke(
             FunctionName=function_name,
             LogType='Tail',
@@ -143,31 +197,31 @@ def test_exported_variables():
     suffix = get_temp_suffix()
     layer_name = 'temp-layer-2-' + suffix
 
-    connection_args = {}
-    if os.getenv('LAMBDA_URL', None):
-        connection_args['endpoint_url'] = os.environ['LAMBDA_URL']
-    if os.getenv('AWS_DEFAULT_REGION', None):
-        connection_args['region_name'] = os.environ['AWS_DEFAULT_REGION']
-    lambda_client = boto3.client('lambda', **connection_args)
+    lambda_client = _get_client('lambda', LAMBDA_ENDPOINT_URL, REGION)
 
     response = lambda_client.list_layer_versions(
         LayerName=layer_name,
     )
 
-    assert not response.get('LayerVersions', [])
+    assert not response.get('LayerVersions')
 
     LOGGER.info('Checking the variables')
 
-    with open(os.path.join(get_temp_path(), 'role-variables-side-effects-present.json')) as fp:
-        vars_presence = json.load(fp)
-    with open(os.path.join(get_temp_path(), 'role-variables-side-effects-absent.json')) as fp:
-        vars_absence = json.load(fp)
-    with open(os.path.join(get_temp_path(), 'role-variables-check-present.json')) as fp:
-        vars_presence_check = json.load(fp)
-    with open(os.path.join(get_temp_path(), 'role-variables-check-absent.json')) as fp:
-        vars_absence_check = json.load(fp)
-    with open(os.path.join(get_temp_path(), 'role-variables-build.json')) as fp:
-        vars_build = json.load(fp)
+    paths = [
+        os.path.join(get_temp_path(), 'role-variables-side-effects-present.json'),
+        os.path.join(get_temp_path(), 'role-variables-side-effects-absent.json'),
+        os.path.join(get_temp_path(), 'role-variables-check-present.json'),
+        os.path.join(get_temp_path(), 'role-variables-check-absent.json'),
+        os.path.join(get_temp_path(), 'role-variables-build.json'),
+    ]
+    with ThreadPoolExecutor(max_workers=len(paths)) as executor:
+        (
+            vars_presence,
+            vars_absence,
+            vars_presence_check,
+            vars_absence_check,
+            vars_build,
+        ) = executor.map(load_json, paths)
 
     LOGGER.info('Checking the state')
     assert vars_presence['aws_lambda_dependency_layer_name'] == layer_name
@@ -203,15 +257,6 @@ def test_exported_variables():
     zip_build = vars_build['zip_after_build']['content']
     zip_deploy = vars_presence['zip_after_deploy']['content']
 
-    def get_structure(content):
-        fp = BytesIO(b64decode(content))
-        dirs = set()
-        with ZipFile(fp) as bundle:
-            for item in bundle.infolist():
-                if item.is_dir():
-                    dirs.add(item.filename)
-        return dirs
-
     with open(vars_presence['aws_lambda_dependency_layer_zip'], 'rb') as fp:
         content = b64encode(fp.read()).decode('ascii')
         assert get_structure(zip_build) == get_structure(content)